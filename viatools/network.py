@@ -0,0 +1,234 @@
+import json, logging, timeit
+from bisect import bisect_left
+from .station import Station
+from .timetable import service_day, station_name
+
+"""
+The VIA Rail Canada network, as observed from trip schedules
+
+Adjacency (ex.), built from a Timetable:
+  { "TRTO": { "OAKV": [["79", [0, 1, 2, 3, 4], 1145, 1166], ["79", [5, 6], 1080, 1101]] },
+    "OAKV": { "ALDR": [["79", [0, 1, 2, 3, 4], 1168, 1180], ["79", [5, 6], 1103, 1115]] },
+    ... }
+
+  Each station code maps to its next station codes. Each edge lists the trains
+  running between the two stations as [train number, service days, departure, arrival].
+  A train has one set of edges per timetable (see Timetable), identified by its service days.
+
+Notes:
+   Times are minutes since midnight of the service day. Trains running past midnight
+   keep counting (ex: 00:15 the next day is 1455) so times always increase along a trip.
+   The graph itself is not stored: the Timetable is, and the graph is rebuilt from it
+   when it changes.
+"""
+
+class RouteGraph:
+    """The network of VIA Rail stations and the trains connecting them
+    Built from a Timetable, queries never hit the network"""
+
+    def __init__(self, timetable):
+        """Args:
+            timetable: the Timetable to build the graph from
+        """
+        self.LOG = logging.getLogger(__name__)
+
+        self.timetable = timetable
+
+        # Main adjacency dict of station code to {next station code: [[train, days, depart, arrive]]}
+        self.adjacency = {}
+        self._timetable_version = None # Timetable version the adjacency was built from
+
+        # Station name to station code, loaded when first needed
+        self._station_codes = None
+
+        # Service day to connections sorted by departure, built when first needed (see _day_connections)
+        self._connections = {}
+
+    def add_trip(self, trip):
+        """Adds (or updates) the schedule of a trip to the timetable of the graph
+        Args:
+            trip: a Trip
+        """
+        self.timetable.record(trip.train, trip.date, trip.scheduled_stops())
+
+    def update(self):
+        """Rebuilds the graph if the timetable changed since the last build.
+        Called by the queries"""
+        version = self.timetable.version
+        if version == self._timetable_version: return
+
+        start = timeit.default_timer()
+        adjacency = {}
+        for train, days, stops in self.timetable.schedules():
+            codes = [self._station_code(name) for name, _, _ in stops]
+            for i in range(len(stops) - 1):
+                depart, arrival = stops[i][2], stops[i + 1][1]
+                if depart is None or arrival is None:
+                    self.LOG.debug(u"Train {0}: no scheduled times between {1} and {2}".format(train, codes[i], codes[i + 1]))
+                    continue
+                adjacency.setdefault(codes[i], {}).setdefault(codes[i + 1], []).append([train, days, depart, arrival])
+        for neighbours in adjacency.values():
+            for edges in neighbours.values(): edges.sort(key=lambda e: e[2])
+
+        self.adjacency = adjacency
+        self._connections = {}
+        self._timetable_version = version
+        self.LOG.debug("update: %ss" % (timeit.default_timer() - start))
+
+    def stations(self):
+        """Returns the sorted list of the station codes in the graph"""
+        self.update()
+        codes = set(self.adjacency)
+        for neighbours in self.adjacency.values(): codes.update(neighbours)
+        return sorted(codes)
+
+    def trains(self):
+        """Returns the sorted list of the train numbers in the graph"""
+        self.update()
+        return sorted(set(e[0] for neighbours in self.adjacency.values()
+                                for edges in neighbours.values() for e in edges))
+
+    def direct_trains(self, from_code, to_code, date = None):
+        """Finds the trains going from a station to another without a transfer
+        Args:
+            from_code: departure station code
+            to_code: arrival station code
+            date: date string in format "YYYY-MM-DD" to only get the trains running that day
+                  (by departure from the first station). All the trains if None
+        Returns:
+            a list of leg dicts (see earliest_arrival), sorted by departure time
+        """
+        self.update()
+        from_code, to_code = from_code.upper(), to_code.upper()
+        day = service_day(date) if date else None
+        legs = []
+        for next_code, edges in self.adjacency.get(from_code, {}).items():
+            for train, days, depart, arrival in edges:
+                if day is not None and day not in days: continue
+                # Follow the train until it reaches the destination or ends
+                code, visited = next_code, set([from_code])
+                while code != to_code and code not in visited:
+                    visited.add(code)
+                    arrival, code = self._next_stop(train, days, code, arrival)
+                    if code is None: break
+                if code == to_code:
+                    legs.append(self._leg(train, from_code, to_code, depart, arrival))
+        return sorted(legs, key=lambda l: l["depart_minutes"])
+
+    def earliest_arrival(self, from_code, to_code, date, depart_time = "00:00", transfer_time = 0):
+        """Finds the journey arriving the earliest at a station (Connection Scan Algorithm)
+        Only the trains running on the date are used, including the ones that left
+        the day before and are still running after midnight.
+        Args:
+            from_code: departure station code
+            to_code: arrival station code
+            date: departure date string in format "YYYY-MM-DD"
+            depart_time: earliest departure time string, HH:MM format
+            transfer_time: minimum minutes to change trains at a station
+        Returns:
+            a list of leg dicts, one per train, such as:
+            [{"train": "79", "from": "TRTO", "to": "LNDN",
+              "depart_time": "19:05", "arrival_time": "21:07",
+              "depart_minutes": 1145, "arrival_minutes": 1267}]
+            Times are relative to midnight of the date.
+            None if the destination can't be reached
+        """
+        start = timeit.default_timer()
+        self.update()
+        from_code, to_code = from_code.upper(), to_code.upper()
+        if from_code == to_code: return []
+        connections, departures = self._day_connections(service_day(date))
+
+        earliest = {from_code: self._minutes(depart_time)}
+        boarded = {}  # run: connection where the run was boarded
+        journey = {}  # station code: (boarding connection, alighting connection)
+
+        first = bisect_left(departures, earliest[from_code])
+        for c in connections[first:]:
+            depart, arrival, code, next_code, run = c
+            if to_code in earliest and earliest[to_code] <= depart: break
+
+            if run not in boarded:
+                if code not in earliest: continue
+                ready = earliest[code] + (0 if code == from_code else transfer_time)
+                if ready > depart: continue
+                boarded[run] = c
+
+            if arrival < earliest.get(next_code, arrival + 1):
+                earliest[next_code] = arrival
+                journey[next_code] = (boarded[run], c)
+
+        self.LOG.debug("earliest_arrival: %ss" % (timeit.default_timer() - start))
+
+        if to_code not in journey: return None
+        legs = []
+        code = to_code
+        while code != from_code:
+            board, alight = journey[code]
+            legs.insert(0, self._leg(board[4][0], board[2], alight[3], board[0], alight[1]))
+            code = board[2]
+        return legs
+
+    def _day_connections(self, day):
+        """Flattens the adjacency into the connections of a service day scanned by earliest_arrival:
+        (depart, arrival, station code, next station code, run) tuples sorted by departure.
+        A run is a (train, day offset) tuple: the runs of the day before (offset -1) only keep
+        their connections after midnight, with times moved back a day.
+        Returns:
+            a (connections, departures) tuple
+        """
+        if day not in self._connections:
+            previous_day = (day - 1) % 7
+            connections = []
+            for code, neighbours in self.adjacency.items():
+                for next_code, edges in neighbours.items():
+                    for train, days, depart, arrival in edges:
+                        if day in days:
+                            connections.append((depart, arrival, code, next_code, (train, 0)))
+                        if previous_day in days and depart >= 24 * 60:
+                            connections.append((depart - 24 * 60, arrival - 24 * 60, code, next_code, (train, -1)))
+            connections.sort()
+            self._connections[day] = (connections, [c[0] for c in connections])
+        return self._connections[day]
+
+    def _next_stop(self, train, days, code, arrival):
+        """Returns the (arrival_minutes, station code) of the stop of a train run after a station,
+        or (None, None) if the station is the last stop"""
+        for next_code, edges in self.adjacency.get(code, {}).items():
+            for e in edges:
+                if e[0] == train and e[1] == days and e[2] + 10 >= arrival:
+                    return e[3], next_code
+        return None, None
+
+    def _station_code(self, name):
+        """Returns the code of a station from its name, or the name if no station matches"""
+        if self._station_codes is None:
+            with open(Station.station_json_file) as json_file:
+                self._station_codes = dict((s["sn"].lower(), s["sc"]) for s in json.load(json_file))
+        name = station_name(name)
+        code = self._station_codes.get(name.strip().lower())
+        if not code:
+            self.LOG.debug(u"No station found with name '{0}', using the name as code".format(name))
+            return name.strip().upper()
+        return code
+
+    def _leg(self, train, from_code, to_code, depart, arrival):
+        return { "train": train,
+                 "from": from_code,
+                 "to": to_code,
+                 "depart_time": self._time(depart),
+                 "arrival_time": self._time(arrival),
+                 "depart_minutes": depart,
+                 "arrival_minutes": arrival }
+
+    def _minutes(self, time_str):
+        """HH:MM to minutes since midnight"""
+        hours, minutes = time_str.strip().split(":")
+        return int(hours) * 60 + int(minutes)
+
+    def _time(self, minutes):
+        """Minutes since midnight to HH:MM. Hours go past 24 for the next day (ex: 24:15)"""
+        return "{0:02d}:{1:02d}".format(minutes // 60, minutes % 60)
+
+    def __repr__(self):
+        return "RouteGraph: {0} stations, {1} trains".format(len(self.stations()), len(self.trains()))
@@ -5,11 +5,12 @@ import logging
 class Reservation:
     supported_types = ["boardingpass"]
 
-    def __init__(self, from_type, data):
+    def __init__(self, from_type, data, timetable = None):
         if from_type not in self.supported_types:
             raise AttributeError("'from_type' must be one of the supported input types: {0}".format(self.supported_types))
 
         self.LOG = logging.getLogger(__name__)
+        self.timetable = timetable # Timetable of the trip, see Trip
         if from_type == "boardingpass":
             self._init_reservation_from_boardingpass(boardingpass=data)
 
@@ -33,11 +34,16 @@ class Reservation:
         self.train_number = boardingpass.info["train_number"]
         self.depart_date = boardingpass.info["depart_time"]
         try:
-            self.trip = Trip(self.train_number, self.depart_date.strftime("%Y-%m-%d")) 
+            self.trip = Trip(self.train_number, self.depart_date.strftime("%Y-%m-%d"), timetable=self.timetable)
         except TripIncompleteError, e:
-            # The trip is missing data, don't calculate extra values
-            self.trip = Trip(self.train_number, self.depart_date.strftime("%Y-%m-%d"), metadata=False)
+            # The trip is missing data, don't calculate extra values (scheduled times can come from the timetable)
             self.LOG.debug(str(e))
+            try:
+                self.trip = Trip(self.train_number, self.depart_date.strftime("%Y-%m-%d"), metadata=False, timetable=self.timetable)
+            except Exception, e:
+                # Not in the timetable, and the fetch is still missing data
+                self.LOG.debug(str(e))
+                self.trip = None
         except Exception, e:
             # There was a problem getting the trip
             self.LOG.debug(str(e))
@@ -0,0 +1,43 @@
+import time
+from bs4 import BeautifulSoup
+from viatools.trip import Trip
+
+def train_status_soup(stations):
+    """Builds the BeautifulSoup of a train status page (see trip.py)
+    Args:
+        stations: list of (station_name, arrival, departure) tuples, where arrival and departure
+                  are (scheduled, estimated, actual) tuples of HH:MM strings ("" if blank).
+                  The first arrival and last departure are ignored
+    """
+    cell = lambda text: u"<td>{0}</td>".format(text)
+    rows = [u"<tr><td>Train</td></tr>", u"<tr><td>Station</td><td></td><td>Scheduled</td><td>Estimated</td><td>Actual</td></tr>"]
+    for i, (name, arrival, departure) in enumerate(stations):
+        if i == 0:
+            tds = [cell(name), cell("Dep:")] + [cell(t) for t in departure]
+        elif i == len(stations) - 1:
+            tds = [cell(name), cell("Arr:")] + [cell(t) for t in arrival]
+        else:
+            tds = [cell(name), cell("Arr:Dep:")] + \
+                  [cell(u"<table><tr><td>{0}</td></tr><tr><td>{1}</td></tr></table>".format(a, d)) for a, d in zip(arrival, departure)]
+        rows.append(u"<tr>{0}</tr>".format(u"".join(tds)))
+    rows.append(u"<tr><td>Updated</td></tr>")
+    html = u"<div id='tsicontent'><table>{0}</table></div>".format(u"".join(rows))
+    return BeautifulSoup(html, "html.parser")
+
+def stub_trip(soup, delay = 0, error = None):
+    """Returns a Trip class fetching a soup instead of the train status page
+    Args:
+        soup: the soup returned by each fetch (can be changed with the 'soup' class attribute)
+        delay: seconds each fetch takes
+        error: exception raised by each fetch, after the delay
+    The 'fetches' class attribute counts the fetches
+    """
+    class StubTrip(Trip):
+        fetches = 0
+        def _fetch_raw_train_status(self):
+            StubTrip.fetches += 1
+            time.sleep(StubTrip.delay)
+            if StubTrip.error: raise StubTrip.error
+            return StubTrip.soup
+    StubTrip.soup, StubTrip.delay, StubTrip.error = soup, delay, error
+    return StubTrip
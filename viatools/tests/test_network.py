@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import unittest, os, tempfile
+from viatools.network import RouteGraph
+from viatools.timetable import Timetable
+from fixtures import train_status_soup, stub_trip
+
+MONDAY, TUESDAY, SATURDAY = "2015-02-02", "2015-02-03", "2015-02-07"
+
+class TestRouteGraph(unittest.TestCase):
+    def setUp(self):
+        """Create a small network: Toronto-Windsor and Ottawa-Toronto trains"""
+        self.timetable = Timetable()
+        self.graph = RouteGraph(self.timetable)
+        # Train 79, Toronto-Windsor
+        self.timetable.record(79, MONDAY, [("TORONTO", None, 1145), ("OAKVILLE", 1166, 1168),
+                                           ("LONDON", 1267, 1270), ("WINDSOR", 1390, None)])
+        # Train 43, Ottawa-Toronto
+        self.timetable.record("43  ", MONDAY, [("OTTAWA", None, 660), ("KINGSTON", 760, 762),
+                                               ("TORONTO", 910, None)])
+
+    def test_stations(self):
+        """Station codes of the graph"""
+        self.assertEqual(self.graph.stations(), ["KGON", "LNDN", "OAKV", "OTTW", "TRTO", "WDON"])
+
+    def test_trains(self):
+        """Train numbers are normalized"""
+        self.assertEqual(self.graph.trains(), ["43", "79"])
+
+    def test_direct_trains(self):
+        """Train 79 connects Toronto to London"""
+        legs = self.graph.direct_trains("TRTO", "LNDN")
+        self.assertEqual(len(legs), 1)
+        self.assertEqual(legs[0]["train"], "79")
+        self.assertEqual(legs[0]["depart_time"], "19:05")
+        self.assertEqual(legs[0]["arrival_time"], "21:07")
+        self.assertEqual(self.graph.direct_trains("TRTO", "LNDN", TUESDAY), [])
+        self.assertEqual(self.graph.direct_trains("OTTW", "WDON"), [])
+
+    def test_earliest_arrival_with_transfer(self):
+        """Ottawa to Windsor transfers in Toronto"""
+        legs = self.graph.earliest_arrival("OTTW", "WDON", MONDAY, "08:00", transfer_time=30)
+        self.assertEqual([(l["train"], l["from"], l["to"]) for l in legs],
+                         [("43", "OTTW", "TRTO"), ("79", "TRTO", "WDON")])
+        self.assertEqual(legs[-1]["arrival_time"], "23:10")
+
+    def test_earliest_arrival_missed_connection(self):
+        """No journey when leaving after the last train"""
+        self.assertEqual(self.graph.earliest_arrival("OTTW", "WDON", MONDAY, "12:00"), None)
+
+    def test_earliest_arrival_transfer_time(self):
+        """The transfer is missed when it requires more time than available"""
+        self.assertEqual(self.graph.earliest_arrival("OTTW", "WDON", MONDAY, "08:00", transfer_time=240), None)
+
+    def test_earliest_arrival_service_days(self):
+        """Only the timetable of the day is used"""
+        self.timetable.record(79, SATURDAY, [("TORONTO", None, 1080), ("WINDSOR", 1325, None)])
+        self.assertEqual(self.graph.earliest_arrival("TRTO", "WDON", MONDAY)[0]["arrival_time"], "23:10")
+        self.assertEqual(self.graph.earliest_arrival("TRTO", "WDON", SATURDAY)[0]["arrival_time"], "22:05")
+        self.assertEqual(self.graph.earliest_arrival("TRTO", "WDON", TUESDAY), None)
+        self.assertEqual(len(self.graph.direct_trains("TRTO", "WDON")), 2)
+
+    def test_earliest_arrival_overnight(self):
+        """Trains of the day before can be boarded after midnight"""
+        self.timetable.record(22, MONDAY, [(u"MONTRÉAL", None, 1380), ("DRUMMONDVILLE", 1470, 1472),
+                                           (u"QUÉBEC", 1570, None)])
+        legs = self.graph.earliest_arrival("DRMV", "QBEC", TUESDAY)
+        self.assertEqual([(l["train"], l["depart_time"], l["arrival_time"]) for l in legs], [("22", "00:32", "02:10")])
+        legs = self.graph.earliest_arrival("DRMV", "QBEC", MONDAY)
+        self.assertEqual([(l["train"], l["depart_time"], l["arrival_time"]) for l in legs], [("22", "24:32", "26:10")])
+
+    def test_update_train(self):
+        """A schedule change in the timetable replaces the schedule of the train"""
+        self.timetable.record(79, MONDAY, [("TORONTO", None, 1200), ("WINDSOR", 1440, None)])
+        self.assertEqual(self.graph.stations(), ["KGON", "OTTW", "TRTO", "WDON"])
+        self.assertEqual(self.graph.earliest_arrival("TRTO", "WDON", MONDAY)[0]["arrival_time"], "24:00")
+
+    def test_add_trip(self):
+        """Trip station names (accented, UTF-8) become station codes, overnight times carry over"""
+        soup = train_status_soup([(u"MONTRÉAL", None, ("23:00", "", "")),
+                                  (u"DORVAL", ("23:20", "", ""), ("23:22", "", "")),
+                                  (u"QUÉBEC", ("02:10", "", ""), None)])
+        trip = stub_trip(soup)(22, MONDAY, metadata=False)
+        self.assertEqual(trip.scheduled_stops(), [(u"MONTRÉAL".encode("utf8"), None, 1380),
+                                                  ("DORVAL", 1400, 1402),
+                                                  (u"QUÉBEC".encode("utf8"), 1570, None)])
+        self.graph.add_trip(trip)
+        self.assertTrue(set(["MTRL", "DORV", "QBEC"]) <= set(self.graph.stations()))
+        legs = self.graph.direct_trains("MTRL", "QBEC")
+        self.assertEqual([(l["train"], l["depart_time"], l["arrival_time"]) for l in legs], [("22", "23:00", "26:10")])
+
+    def test_saved_timetable(self):
+        """The graph of a saved and loaded timetable is the same"""
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            self.timetable.save(path)
+            loaded = RouteGraph(Timetable(path))
+            self.assertEqual(loaded.stations(), self.graph.stations())
+            self.assertEqual(loaded.earliest_arrival("OTTW", "WDON", MONDAY, "08:00"),
+                             self.graph.earliest_arrival("OTTW", "WDON", MONDAY, "08:00"))
+        finally:
+            os.remove(path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+from datetime import datetime
+import viatools.reservation
+from viatools.reservation import Reservation
+from viatools.timetable import Timetable
+from viatools.trip import Trip, TripIncompleteError
+from fixtures import train_status_soup, stub_trip
+
+class BoardingPass:
+    """A decoded boarding pass for train 79, Toronto-Windsor"""
+    message = "barcode"
+    info = { "etf": "0507201327229", "reservation_confirmation": "ADTZZG",
+             "passenger_last_name": "Durette", "passenger_first_name": "Pierre Nicolas",
+             "train_car": "4", "train_seat": "8D", "train_operator": "VIA", "train_luggage_rule": "NB",
+             "train_number": 79, "depart_time": datetime(2015, 2, 2, 19, 5),
+             "depart_station_code": "TRTO", "arrival_station_code": "WDON" }
+
+class TestReservationTrip(unittest.TestCase):
+    def setUp(self):
+        """Every fetch of the trip is missing data"""
+        self.StubTrip = stub_trip(None, error=TripIncompleteError("The trip was found but is missing data"))
+        viatools.reservation.Trip = self.StubTrip
+
+    def tearDown(self):
+        viatools.reservation.Trip = Trip
+
+    def test_incomplete_trip_from_timetable(self):
+        """The scheduled times come from the timetable when the trip is missing data"""
+        timetable = Timetable()
+        timetable.record(79, "2015-02-02", [("TORONTO", None, 1145), ("WINDSOR", 1390, None)])
+        reservation = Reservation("boardingpass", BoardingPass(), timetable=timetable)
+        self.assertEqual(self.StubTrip.fetches, 1)
+        self.assertEqual(reservation.trip.schedule[-1]["arrival_time_scheduled"], datetime(2015, 2, 2, 23, 10))
+
+    def test_incomplete_trip_not_in_timetable(self):
+        """No trip when the trip is missing data and not in the timetable"""
+        reservation = Reservation("boardingpass", BoardingPass(), timetable=Timetable())
+        self.assertEqual(reservation.trip, None)
+        self.assertEqual(reservation.depart_station.code, "TRTO")
+
+    def test_incomplete_trip_without_timetable(self):
+        """No trip when the trip is missing data and there's no timetable"""
+        self.assertEqual(Reservation("boardingpass", BoardingPass()).trip, None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import unittest, os, tempfile, threading
+from datetime import datetime
+from viatools.timetable import Timetable
+from fixtures import train_status_soup, stub_trip
+
+class TestTimetable(unittest.TestCase):
+    def setUp(self):
+        """Create a store with train 79 recorded on a Monday"""
+        self.timetable = Timetable()
+        self.weekday = [("TORONTO", None, 1145), ("LONDON", 1267, 1270), ("WINDSOR", 1390, None)]
+        self.weekend = [("TORONTO", None, 1080), ("LONDON", 1202, 1205), ("WINDSOR", 1325, None)]
+        self.timetable.record(79, "2015-02-02", self.weekday) # Monday
+
+    def test_lookup(self):
+        """Recorded stops are found for the same service day only"""
+        self.assertEqual(self.timetable.lookup("79", "2015-02-09"), self.weekday)
+        self.assertEqual(self.timetable.lookup(79, "2015-02-03"), None)
+        self.assertEqual(self.timetable.lookup(83, "2015-02-02"), None)
+
+    def test_record_same_schedule(self):
+        """Recording a known schedule doesn't change the store"""
+        self.assertFalse(self.timetable.record(79, "2015-02-09", self.weekday))
+        self.assertTrue(self.timetable.record(79, "2015-02-03", self.weekday))
+        self.assertEqual(len(self.timetable.trains["79"]), 1)
+        self.assertEqual(self.timetable.trains["79"][0]["days"], [0, 1])
+
+    def test_record_schedule_change(self):
+        """A disagreeing schedule replaces the stored one for that service day"""
+        self.timetable.record(79, "2015-02-07", self.weekend) # Saturday
+        self.assertTrue(self.timetable.record(79, "2015-02-09", self.weekend))
+        self.assertEqual(self.timetable.lookup(79, "2015-02-02"), self.weekend)
+        self.assertEqual(self.timetable.trains["79"], [{"days": [0, 5], "stops": [list(s) for s in self.weekend]}])
+
+    def test_save_load(self):
+        """The store survives a save and load"""
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            self.timetable.save(path)
+            loaded = Timetable(path)
+            self.assertEqual(loaded.lookup(79, "2015-02-02"), self.weekday)
+            self.assertFalse(loaded.record(79, "2015-02-02", self.weekday))
+        finally:
+            os.remove(path)
+
+    def test_record_concurrent_schedule_changes(self):
+        """Schedule changes recorded from several threads for the same service day"""
+        errors = []
+        def record(stops):
+            try:
+                for _ in range(200): self.timetable.record(79, "2015-02-02", stops)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=record, args=(stops,)) for stops in [self.weekday, self.weekend] * 4]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual([t["days"] for t in self.timetable.trains["79"]], [[0]])
+
+class TestTripTimetable(unittest.TestCase):
+    def setUp(self):
+        """Train 79 fetches a Toronto-Windsor train status page"""
+        self.timetable = Timetable()
+        self.StubTrip = stub_trip(train_status_soup([("TORONTO", None, ("19:05", "", "19:05")),
+                                                     ("LONDON", ("21:07", "", "21:09"), ("21:10", "21:12", "")),
+                                                     ("WINDSOR", ("23:10", "23:12", ""), None)]))
+
+    def test_scheduled_only_from_timetable(self):
+        """A scheduled-only trip in the timetable is not fetched"""
+        self.timetable.record(79, "2015-02-02", [("TORONTO", None, 1145), ("WINDSOR", 1390, None)])
+        trip = self.StubTrip(79, "2015-02-09", metadata=False, timetable=self.timetable)
+        self.assertEqual(self.StubTrip.fetches, 0)
+        self.assertEqual([s["station_name"] for s in trip.schedule], ["TORONTO", "WINDSOR"])
+        self.assertEqual(trip.schedule[0]["depart_time_scheduled"], datetime(2015, 2, 9, 19, 5))
+        self.assertEqual(trip.schedule[0]["depart_time_actual"], None)
+
+    def test_scheduled_only_not_in_timetable(self):
+        """A scheduled-only trip missing from the timetable is fetched"""
+        self.StubTrip(79, "2015-02-03", metadata=False, timetable=self.timetable)
+        self.assertEqual(self.StubTrip.fetches, 1)
+
+    def test_fetch_records(self):
+        """A fetched trip records its schedule"""
+        trip = self.StubTrip(79, "2015-02-02", timetable=self.timetable)
+        self.assertEqual(self.StubTrip.fetches, 1)
+        self.assertEqual(self.timetable.lookup(79, "2015-02-09"), trip.scheduled_stops())
+        self.assertEqual(self.timetable.lookup(79, "2015-02-09"),
+                         [("TORONTO", None, 1145), ("LONDON", 1267, 1270), ("WINDSOR", 1390, None)])
+
+    def test_fetch_schedule_change(self):
+        """A fetched trip disagreeing with the timetable moves its service day to the new schedule"""
+        self.timetable.record(79, "2015-02-02", [("TORONTO", None, 1080), ("WINDSOR", 1325, None)])
+        self.timetable.record(79, "2015-02-03", [("TORONTO", None, 1080), ("WINDSOR", 1325, None)])
+        self.StubTrip(79, "2015-02-09", timetable=self.timetable)
+        self.assertEqual(self.timetable.lookup(79, "2015-02-09")[0], ("TORONTO", None, 1145))
+        self.assertEqual(self.timetable.lookup(79, "2015-02-10")[0], ("TORONTO", None, 1080))
+        self.assertEqual(sorted(t["days"] for t in self.timetable.trains["79"]), [[0], [1]])
+
+    def test_scheduled_only_overnight(self):
+        """An overnight scheduled-only trip has the same scheduled times fetched or from the timetable"""
+        StubTrip = stub_trip(train_status_soup([(u"MONTRÉAL", None, ("23:00", "", "")),
+                                                (u"DRUMMONDVILLE", ("00:30", "", ""), ("00:32", "", "")),
+                                                (u"QUÉBEC", ("02:10", "", ""), None)]))
+        scheduled = lambda trip: [(s["arrival_time_scheduled"], s["depart_time_scheduled"]) for s in trip.schedule]
+        fetched = StubTrip(22, "2015-02-02", metadata=False, timetable=self.timetable)
+        stored = StubTrip(22, "2015-02-02", metadata=False, timetable=self.timetable)
+        self.assertEqual(StubTrip.fetches, 1)
+        self.assertEqual(scheduled(fetched), scheduled(stored))
+        self.assertEqual(scheduled(fetched), [(None, datetime(2015, 2, 2, 23, 0)),
+                                              (datetime(2015, 2, 3, 0, 30), datetime(2015, 2, 3, 0, 32)),
+                                              (datetime(2015, 2, 3, 2, 10), None)])
+
+if __name__ == '__main__':
+    unittest.main()
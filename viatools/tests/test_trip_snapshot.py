@@ -0,0 +1,88 @@
+import unittest, copy, threading
+from viatools.trip import Trip
+from fixtures import train_status_soup, stub_trip
+
+# Train 79, Toronto-Windsor, between London and Windsor
+STATIONS = [("TORONTO", None, ("19:05", "", "19:05")),
+            ("LONDON", ("21:07", "", "21:09"), ("21:10", "", "21:12")),
+            ("WINDSOR", ("23:10", "23:12", ""), None)]
+
+class TestTripSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.StubTrip = stub_trip(train_status_soup(STATIONS))
+        self.trip = self.StubTrip(79, "2015-02-02")
+        self.StubTrip.fetches = 0
+
+    def test_snapshot(self):
+        """The trip attributes are the ones of its snapshot"""
+        snapshot = self.trip.snapshot
+        self.assertEqual(snapshot.current_station_name, "LONDON")
+        self.assertEqual(self.trip.current_station_name, "LONDON")
+        self.assertTrue(snapshot.current_station is snapshot.schedule[1])
+        self.assertEqual(self.trip.num_stations, 3)
+
+    def test_read_only_attributes(self):
+        """The trip attributes can't be set"""
+        for name in ["schedule", "departed", "current_station", "late", "time_left", "snapshot"]:
+            self.assertRaises(AttributeError, setattr, self.trip, name, None)
+
+    def test_read_only_schedule(self):
+        """The station dicts of a snapshot can't be changed"""
+        station = self.trip.snapshot.schedule[1]
+        self.assertRaises(TypeError, station.__setitem__, "station_name", "OAKVILLE")
+        self.assertRaises(TypeError, station.update, {"station_name": "OAKVILLE"})
+        self.assertRaises(TypeError, station.pop, "station_name")
+        self.assertRaises(TypeError, self.trip.current_station.__delitem__, "station_name")
+        self.assertEqual(copy.deepcopy(station), station)
+        self.assertEqual(self.trip.current_station_name, "LONDON")
+
+    def _concurrent_updates(self, count = 5):
+        """Calls update() from several threads at once during a slow fetch
+        Returns:
+            the list of exceptions raised by the calls
+        """
+        self.StubTrip.delay = 0.3
+        start, errors = threading.Event(), []
+        def update():
+            start.wait()
+            try:
+                self.trip.update()
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=update) for _ in range(count)]
+        for t in threads: t.start()
+        start.set()
+        for t in threads: t.join()
+        return errors
+
+    def test_concurrent_updates(self):
+        """Concurrent updates of a trip are collapsed into one fetch"""
+        snapshot = self.trip.snapshot
+        self.assertEqual(self._concurrent_updates(), [])
+        self.assertEqual(self.StubTrip.fetches, 1)
+        self.assertFalse(self.trip.snapshot is snapshot)
+
+    def test_concurrent_updates_error(self):
+        """The callers waiting for a failed update get its exception"""
+        error = RuntimeError("Connection reset")
+        self.StubTrip.error = error
+        errors = self._concurrent_updates()
+        self.assertEqual(self.StubTrip.fetches, 1)
+        self.assertEqual(len(errors), 5)
+        self.assertTrue(all(e is error for e in errors))
+
+    def test_failed_update(self):
+        """A failed update keeps the previous snapshot published"""
+        snapshot = self.trip.snapshot
+        self.StubTrip.error = RuntimeError("Connection reset")
+        self.assertRaises(RuntimeError, self.trip.update)
+        self.assertTrue(self.trip.snapshot is snapshot)
+        self.assertEqual(self.trip.current_station_name, "LONDON")
+
+        # The next update is not affected by the error
+        self.StubTrip.error = None
+        self.trip.update()
+        self.assertFalse(self.trip.snapshot is snapshot)
+
+if __name__ == '__main__':
+    unittest.main()
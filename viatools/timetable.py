@@ -0,0 +1,139 @@
+import os, json, logging, threading
+from datetime import datetime
+
+"""
+A local store of VIA Rail Canada scheduled timetables, as observed from trip schedules
+
+Store (ex.), persisted as JSON:
+  { "79": [ { "days": [0, 1, 2, 3, 4],
+              "stops": [["TORONTO", null, 1145], ["OAKVILLE", 1166, 1168], ..., ["WINDSOR", 1390, null]] },
+            { "days": [5, 6],
+              "stops": [["TORONTO", null, 1080], ..., ["WINDSOR", 1325, null]] } ] }
+
+  Each train number maps to its timetables. A timetable has the service days it was
+  observed on (0 is Monday, see datetime.weekday) and its stops as
+  [station name, arrival, departure], in minutes (see Trip.scheduled_stops).
+
+Notes:
+   A service day belongs to a single timetable of a train. When a trip recorded on a day
+   disagrees with the stored timetable for that day, the day moves to the new timetable.
+   A Timetable can be shared by several Trips updating in different threads.
+"""
+
+def train_number(train):
+    """Train number as stored: boarding passes have them padded, trips may have them as integers"""
+    return str(train).strip()
+
+def station_name(name):
+    """Station name as stored: Trip has them as UTF-8 bytes, json.load returns unicode"""
+    return name if isinstance(name, unicode) else name.decode("utf8")
+
+def service_day(date):
+    """Service day of a "YYYY-MM-DD" date string (0 is Monday, see datetime.weekday)"""
+    return datetime.strptime(date.strip(), "%Y-%m-%d").weekday()
+
+class Timetable:
+    """Scheduled stops and times of trains, by service day
+    Populated from fetched trips, lookups never hit the network"""
+
+    def __init__(self, path = None):
+        """Args:
+            path: JSON file to load the store from and save it to.
+                  Starts with an empty store if the file doesn't exist yet
+        """
+        self.LOG = logging.getLogger(__name__)
+
+        self.path = path
+        self.trains = {}
+        self.version = 0 # Incremented on every change
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def load(self, path):
+        """Loads the store from a JSON file, replacing the current one"""
+        with open(path) as json_file:
+            trains = json.load(json_file)
+        with self._lock:
+            self.trains = trains
+            self.version += 1
+
+    def save(self, path = None):
+        """Saves the store to a JSON file (defaults to the file it was loaded from)"""
+        path = path or self.path
+        if not path:
+            raise AttributeError("Expected a 'path' to save the Timetable to")
+        with self._lock, open(path, "w") as json_file:
+            json.dump(self.trains, json_file, indent=4, sort_keys=True)
+
+    def lookup(self, train, date):
+        """Finds the scheduled stops of a train on a date
+        Args:
+            train: Via train number
+            date: date string in format "YYYY-MM-DD"
+        Returns:
+            a list of (station_name, arrival_minutes, depart_minutes) tuples
+            or None if the train was never recorded on that service day
+        """
+        with self._lock:
+            timetable = self._timetable(self.trains.get(train_number(train), []), service_day(date))
+            return [tuple(s) for s in timetable["stops"]] if timetable else None
+
+    def record(self, train, date, stops):
+        """Records the scheduled stops of a train on a date
+        Args:
+            train: Via train number
+            date: date string in format "YYYY-MM-DD"
+            stops: a list of (station_name, arrival_minutes, depart_minutes) tuples
+                   (see Trip.scheduled_stops)
+        Returns:
+            True if the store changed (new service day or schedule change), False otherwise
+        """
+        train, day = train_number(train), service_day(date)
+        stops = [self._stop(s) for s in stops]
+
+        with self._lock:
+            timetables = self.trains.setdefault(train, [])
+
+            # Already known
+            current = self._timetable(timetables, day)
+            if current and current["stops"] == stops: return False
+
+            # Schedule change: the day leaves its previous timetable
+            if current:
+                self.LOG.debug("Train {0}: schedule changed on {1}".format(train, date))
+                current["days"].remove(day)
+                if not current["days"]: timetables.remove(current)
+
+            # The day joins the timetable with the same stops, or a new one
+            for timetable in timetables:
+                if timetable["stops"] == stops:
+                    timetable["days"] = sorted(timetable["days"] + [day])
+                    break
+            else:
+                timetables.append({"days": [day], "stops": stops})
+            self.version += 1
+            return True
+
+    def schedules(self):
+        """Lists all the stored timetables
+        Returns:
+            a list of (train, days, stops) tuples, stops as returned by lookup
+        """
+        with self._lock:
+            return [(train, list(timetable["days"]), [tuple(s) for s in timetable["stops"]])
+                    for train, timetables in self.trains.items() for timetable in timetables]
+
+    def _timetable(self, timetables, day):
+        for timetable in timetables:
+            if day in timetable["days"]: return timetable
+        return None
+
+    def _stop(self, stop):
+        """Stop as stored"""
+        name, arrival, depart = stop
+        return [station_name(name), arrival, depart]
+
+    def __repr__(self):
+        return "Timetable: {0} trains".format(len(self.trains))
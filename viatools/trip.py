@@ -1,7 +1,8 @@
 import requests, re
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
-import logging, timeit
+from collections import namedtuple
+import logging, timeit, threading
 
 """
 A VIA Rail Canada trip
@@ -39,18 +40,69 @@ The times tells us the status:
    If the last station has arrival_time_actual set, the trip has concluded
 """
 
-class Trip:
+# An immutable, consistent view of a trip. Trip.update() builds a new one and publishes it at once
+TripSnapshot = namedtuple("TripSnapshot", ["schedule", "departed", "arrived", "num_stations",
+                                           "start_station_name", "end_station_name",
+                                           "current_station", "current_station_name",
+                                           "late", "early", "schedule_timedelta",
+                                           "time_elapsed", "time_left"])
+
+class StationTimes(dict):
+    """A read-only station dict of a TripSnapshot schedule"""
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("The station dicts of a TripSnapshot are read-only")
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        # copy and pickle would otherwise fill the copy with __setitem__
+        return (StationTimes, (dict(self),))
+
+def _snapshot_property(name):
+    """A read-only Trip attribute, read from the current snapshot"""
+    return property(lambda self: getattr(self._snapshot, name))
+
+class Trip(object):
     """A Via Rail Trip
     Time information is only available for the Windsor-Quebec City Corridor"""
     train_schedule_url = "http://reservia.viarail.ca/tsi/GetTrainStatus.aspx"
 
-    def __init__(self, train, date, metadata = True):
+    # Before the first update
+    empty_snapshot = TripSnapshot(schedule=(), departed=False, arrived=False, num_stations=0,
+                                  start_station_name=None, end_station_name=None,
+                                  current_station=None, current_station_name=None,
+                                  late=False, early=False, schedule_timedelta=None,
+                                  time_elapsed=None, time_left=None)
+
+    # Main tuple of station dicts, such as:
+    # ({"station": "TORONTO",
+    # "arrival_time_scheduled": None, "arrival_time_estimated": None, "arrival_time_actual": None,
+    # "depart_time_scheduled": "19:05", "depart_time_estimated": None, "depart_time_actual": "19:50"},)
+    # The dicts are read-only StationTimes
+    schedule = _snapshot_property("schedule")
+
+    # Trip properties
+    departed = _snapshot_property("departed")
+    arrived = _snapshot_property("arrived")
+    num_stations = _snapshot_property("num_stations")
+    start_station_name = _snapshot_property("start_station_name")
+    end_station_name = _snapshot_property("end_station_name")
+    current_station = _snapshot_property("current_station")
+    current_station_name = _snapshot_property("current_station_name")
+    late = _snapshot_property("late")
+    early = _snapshot_property("early")
+    schedule_timedelta = _snapshot_property("schedule_timedelta")
+    time_elapsed = _snapshot_property("time_elapsed")
+    time_left = _snapshot_property("time_left")
+
+    def __init__(self, train, date, metadata = True, timetable = None):
         """Args:
             train: Via train number integer
             date: Arrival date string in format "YYYY-MM-DD"
             metadata: Calculate and infer additional properties
                       Set to False when a trip is imcomplete or when only the scheduled
                       times and list of stations are required
+            timetable: a Timetable. Fetched schedules are recorded to it and, when
+                       metadata is False, the schedule is read from it instead of fetched
         """
         # TODO validate input
         self.LOG = logging.getLogger(__name__)
@@ -58,44 +110,85 @@ class Trip:
         self.train = train
         self.date = date
         self.metadata = metadata
+        self.timetable = timetable
 
-        # Main list of station dicts, such as:
-        # [{"station": "TORONTO",
-        # "arrival_time_scheduled": None, "arrival_time_estimated": None, "arrival_time_actual": None,
-        # "depart_time_scheduled": "19:05", "depart_time_estimated": None, "depart_time_actual": "19:50"}]
-        self.schedule = []
-
-        # Trip properties        
-        self.departed = False
-        self.arrived = False
-        self.num_stations = 0
-        self.start_station_name = None
-        self.end_station_name = None
-        self.current_station = None
-        self.current_station_name = None
-        self.late = False
-        self.early = False
-        self.schedule_timedelta = None
-        self.time_elapsed = None
-        self.time_left = None
+        # The published snapshot. Replaced, never modified
+        self._snapshot = self.empty_snapshot
+
+        # Collapses concurrent updates (see update)
+        self._update_condition = threading.Condition()
+        self._updating = False
+        self._update_count = 0
+        self._update_error = None
 
         # Fill in blanks
         self.update()
 
+    @property
+    def snapshot(self):
+        """The current TripSnapshot. Read it once to get a consistent view of the trip
+        while other threads call update()"""
+        return self._snapshot
+
     def update(self):
-        """Requests a trip update from Via. Call to refresh the trip"""
+        """Requests a trip update from Via. Call to refresh the trip
+        Thread-safe: a call made while another thread updates this trip waits for that
+        update and shares its result (or its exception) instead of fetching again"""
+        with self._update_condition:
+            if self._updating:
+                update_count = self._update_count
+                while self._update_count == update_count: self._update_condition.wait()
+                if self._update_error: raise self._update_error
+                return
+            self._updating = True
+
+        snapshot, error = None, None
         try:
-            soup = self._fetch_raw_train_status() # The raw
-            self.schedule = self._create_trip_struct(soup) # The struct
-           
-            if self.metadata:
-                self._generate_properties(self.schedule) # Generate has_arrived, has_departed, ...
-                self.schedule = self._adjust_day_difference(self.schedule) # Adjust days if necessary
-                self._calculate_time_deltas(self.schedule) # Calculate the misc. times (left, since departure, late, early)
-        except TripNotFoundError, e:
-            raise
+            snapshot = self._create_snapshot()
         except Exception, e:
+            error = e
             raise
+        finally:
+            with self._update_condition:
+                if snapshot: self._snapshot = snapshot # Publish
+                self._update_error = error
+                self._updating = False
+                self._update_count += 1
+                self._update_condition.notify_all()
+
+    def _create_snapshot(self):
+        """Creates a new snapshot of the trip, without touching the published one
+        Returns:
+            a TripSnapshot
+        """
+        # Scheduled times only: no need to fetch if the timetable has them
+        if self.timetable and not self.metadata:
+            stops = self.timetable.lookup(self.train, self.date)
+            if stops:
+                return self.empty_snapshot._replace(schedule=self._freeze(self._create_trip_struct_from_stops(stops)))
+
+        soup = self._fetch_raw_train_status() # The raw
+        schedule = self._create_trip_struct(soup) # The struct
+        if self.timetable: self.timetable.record(self.train, self.date, self._scheduled_stops(schedule))
+
+        if self.metadata: schedule = self._adjust_day_difference(schedule) # Adjust days if necessary
+        else: schedule = self._adjust_scheduled_days(schedule) # Same scheduled times as from the timetable
+        schedule = self._freeze(schedule) # Before the properties: current_station is one of its dicts
+
+        properties = {}
+        if self.metadata:
+            properties.update(self._generate_properties(schedule)) # Generate has_arrived, has_departed, ...
+            properties.update(self._calculate_time_deltas(schedule, properties["current_station"])) # Calculate the misc. times (left, since departure, late, early)
+        return self.empty_snapshot._replace(schedule=schedule, **properties)
+
+    def _freeze(self, schedule):
+        """Makes a schedule struct read-only, to be published in a snapshot
+        Args:
+            schedule: a schedule struct
+        Returns:
+            a tuple of StationTimes
+        """
+        return tuple(StationTimes(s) for s in schedule)
 
     def _create_trip_struct(self, soup):
         """Creates a trip list struct by parsing the train status html page
@@ -170,6 +263,47 @@ class Trip:
         
         return trip_schedule
 
+    def _create_trip_struct_from_stops(self, stops):
+        """Creates a trip list struct from scheduled stops. Estimated and actual times are None
+        Args:
+            stops: a list of (station_name, arrival_minutes, depart_minutes) tuples
+                   (see scheduled_stops)
+        Returns:
+            The main schedule structure
+        """
+        trip_schedule = []
+        for station_position, (name, arrival, depart) in enumerate(stops):
+            this_station = { "station_name": name.encode('utf8'),
+                    "station_position" : station_position,
+                    "arrival_time_scheduled": self._scheduled_datetime(arrival),
+                    "arrival_time_estimated": None,
+                    "arrival_time_actual":    None,
+                    "depart_time_scheduled":  self._scheduled_datetime(depart),
+                    "depart_time_estimated":  None,
+                    "depart_time_actual":     None }
+            trip_schedule.append(this_station)
+        return trip_schedule
+
+    def _adjust_scheduled_days(self, schedule):
+        """Adds a day to the scheduled times past midnight, like scheduled_stops.
+        Used instead of _adjust_day_difference when metadata is not calculated, so a fetched
+        schedule has the same scheduled times as one created from the timetable.
+        Args:
+            schedule: a schedule struct
+        Returns:
+            a time updated copy of the schedule struct
+        """
+        schedule = [dict(s) for s in schedule]
+        for s, (_, arrival, depart) in zip(schedule, self._scheduled_stops(schedule)):
+            s["arrival_time_scheduled"] = self._scheduled_datetime(arrival)
+            s["depart_time_scheduled"] = self._scheduled_datetime(depart)
+        return schedule
+
+    def _scheduled_datetime(self, minutes):
+        """Datetime of minutes since midnight of the trip date (see scheduled_stops), or None"""
+        if minutes is None: return None
+        return datetime.strptime(self.date, "%Y-%m-%d") + timedelta(minutes=minutes)
+
     def _adjust_day_difference(self, schedule):
         """Scans the trip struct for each time column (scheduled, estimated, actual),
         Adds a day if necessary (if next time is smaller, it's the next day)
@@ -180,11 +314,12 @@ class Trip:
         Args:
             schedule: a schedule struct
         Returns:
-            a time updated schedule struct
+            a time updated copy of the schedule struct
         """
         time_type = ["scheduled", "estimated", "actual"]
+        schedule = [dict(s) for s in schedule]
 
-        for i, obj in enumerate(self.schedule):
+        for i, obj in enumerate(schedule):
             for t in time_type:
                 # Same station: between Arr. and Dep.
                 if schedule[i]["arrival_time_" + t] and schedule[i]["depart_time_" + t] \
@@ -202,69 +337,81 @@ class Trip:
         Args:
             schedule: a schedule struct
         Returns:
-            Nothing. The class attributes are changed
+            a dict of the TripSnapshot location fields
         """
-        self.departed = True if schedule[0]["depart_time_actual"] else False
-        self.arrived = True if schedule[-1]["arrival_time_actual"] else False
-        
-        self.num_stations = len(self.schedule)
-        self.start_station_name = schedule[0]["station_name"]
-        self.end_station_name = schedule[-1]["station_name"]
-        self.current_station = self._get_current_train_location(schedule)
-        self.current_station_name = self.current_station["station_name"]
+        current_station = self._get_current_train_location(schedule)
+        return { "departed": True if schedule[0]["depart_time_actual"] else False,
+                 "arrived": True if schedule[-1]["arrival_time_actual"] else False,
+                 "num_stations": len(schedule),
+                 "start_station_name": schedule[0]["station_name"],
+                 "end_station_name": schedule[-1]["station_name"],
+                 "current_station": current_station,
+                 "current_station_name": current_station["station_name"] }
         
-    def _calculate_time_deltas(self, schedule):
-        """Calculate the time lenghts of the trip"""
+    def _calculate_time_deltas(self, schedule, current_station):
+        """Calculate the time lenghts of the trip
+        Args:
+            schedule: a schedule struct
+            current_station: the station dict where the train was last seen
+        Returns:
+            a dict of the TripSnapshot time fields
+        """
         # Time difference with scheduled time (scheduled vs. actual)
         # The trip has not yet departed OR is departed but not reached the first station
         if schedule[0]["depart_time_scheduled"] and not schedule[0]["depart_time_actual"] or not schedule[1]["arrival_time_actual"]:
-            self.late = True if schedule[0]["depart_time_estimated"] and schedule[0]["depart_time_estimated"] > schedule[0]["depart_time_scheduled"] else False
-            self.early = True if schedule[0]["depart_time_estimated"] and schedule[0]["depart_time_estimated"] < schedule[0]["depart_time_scheduled"] else False
-            if self.late:
-                self.schedule_timedelta = schedule[0]["arrival_time_estimated"] - schedule[-1]["arrival_time_scheduled"]
-            elif self.early:
-                self.schedule_timedelta = schedule[0]["arrival_time_scheduled"] - schedule[-1]["arrival_time_estimated"]
-            else: self.schedule_timedelta = timedelta()
-            self.time_elapsed = timedelta()
-            self.time_left = schedule[-1]["arrival_time_scheduled"] - schedule[0]["depart_time_scheduled"]
+            late = True if schedule[0]["depart_time_estimated"] and schedule[0]["depart_time_estimated"] > schedule[0]["depart_time_scheduled"] else False
+            early = True if schedule[0]["depart_time_estimated"] and schedule[0]["depart_time_estimated"] < schedule[0]["depart_time_scheduled"] else False
+            if late:
+                schedule_timedelta = schedule[0]["arrival_time_estimated"] - schedule[-1]["arrival_time_scheduled"]
+            elif early:
+                schedule_timedelta = schedule[0]["arrival_time_scheduled"] - schedule[-1]["arrival_time_estimated"]
+            else: schedule_timedelta = timedelta()
+            time_elapsed = timedelta()
+            time_left = schedule[-1]["arrival_time_scheduled"] - schedule[0]["depart_time_scheduled"]
 
         # Trip has concluded
         elif schedule[-1]["arrival_time_actual"]:
-            self.late = True if schedule[-1]["arrival_time_actual"] > schedule[-1]["arrival_time_scheduled"] else False
-            self.early = True if schedule[-1]["arrival_time_actual"] < schedule[-1]["arrival_time_scheduled"] else False
-            if self.late:
-                self.schedule_timedelta = schedule[-1]["arrival_time_actual"] - schedule[-1]["arrival_time_scheduled"]
-            elif self.early:
-                self.schedule_timedelta = schedule[-1]["arrival_time_scheduled"] - schedule[-1]["arrival_time_actual"]
-            else: self.schedule_timedelta = timedelta()
-            self.time_elapsed = schedule[-1]["arrival_time_actual"] - schedule[0]["depart_time_actual"]
-            self.time_left = timedelta()
+            late = True if schedule[-1]["arrival_time_actual"] > schedule[-1]["arrival_time_scheduled"] else False
+            early = True if schedule[-1]["arrival_time_actual"] < schedule[-1]["arrival_time_scheduled"] else False
+            if late:
+                schedule_timedelta = schedule[-1]["arrival_time_actual"] - schedule[-1]["arrival_time_scheduled"]
+            elif early:
+                schedule_timedelta = schedule[-1]["arrival_time_scheduled"] - schedule[-1]["arrival_time_actual"]
+            else: schedule_timedelta = timedelta()
+            time_elapsed = schedule[-1]["arrival_time_actual"] - schedule[0]["depart_time_actual"]
+            time_left = timedelta()
         
         # Trip is in progress.
         # Current station and reference time (either current station's arrival or departure time)
         else:
-            if self.current_station["arrival_time_actual"]:
-                reference_time = self.current_station["arrival_time_actual"]
-                self.late = True if self.current_station["arrival_time_actual"] > self.current_station["arrival_time_scheduled"] else False
-                self.early = True if self.current_station["arrival_time_actual"] < self.current_station["arrival_time_scheduled"] else False
-                if self.late:
-                    self.schedule_timedelta = self.current_station["arrival_time_actual"] - self.current_station["arrival_time_scheduled"]
-                elif self.early:
-                    self.schedule_timedelta = self.current_station["arrival_time_scheduled"] - self.current_station["arrival_time_actual"]
-                else: self.schedule_timedelta = timedelta()    
+            if current_station["arrival_time_actual"]:
+                reference_time = current_station["arrival_time_actual"]
+                late = True if current_station["arrival_time_actual"] > current_station["arrival_time_scheduled"] else False
+                early = True if current_station["arrival_time_actual"] < current_station["arrival_time_scheduled"] else False
+                if late:
+                    schedule_timedelta = current_station["arrival_time_actual"] - current_station["arrival_time_scheduled"]
+                elif early:
+                    schedule_timedelta = current_station["arrival_time_scheduled"] - current_station["arrival_time_actual"]
+                else: schedule_timedelta = timedelta()    
             else: # departure_time_actual
-                reference_time = self.current_station["depart_time_actual"]
-                self.late = True if self.current_station["arrival_time_actual"] > self.current_station["arrival_time_scheduled"] else False
-                self.early = True if self.current_station["arrival_time_actual"] < self.current_station["arrival_time_scheduled"] else False
-                if self.late:
-                    self.schedule_timedelta = self.current_station["arrival_time_actual"] - self.current_station["arrival_time_scheduled"]
-                elif self.early:
-                    self.schedule_timedelta = self.current_station["arrival_time_scheduled"] - self.current_station["arrival_time_actual"]
-                else: self.schedule_timedelta = timedelta()
-
-            self.schedule_timedelta = reference_time - self.current_station["arrival_time_scheduled"]
-            self.time_elapsed = reference_time - schedule[0]["depart_time_actual"]
-            self.time_left = schedule[-1]["arrival_time_estimated"] - reference_time
+                reference_time = current_station["depart_time_actual"]
+                late = True if current_station["arrival_time_actual"] > current_station["arrival_time_scheduled"] else False
+                early = True if current_station["arrival_time_actual"] < current_station["arrival_time_scheduled"] else False
+                if late:
+                    schedule_timedelta = current_station["arrival_time_actual"] - current_station["arrival_time_scheduled"]
+                elif early:
+                    schedule_timedelta = current_station["arrival_time_scheduled"] - current_station["arrival_time_actual"]
+                else: schedule_timedelta = timedelta()
+
+            schedule_timedelta = reference_time - current_station["arrival_time_scheduled"]
+            time_elapsed = reference_time - schedule[0]["depart_time_actual"]
+            time_left = schedule[-1]["arrival_time_estimated"] - reference_time
+
+        return { "late": late,
+                 "early": early,
+                 "schedule_timedelta": schedule_timedelta,
+                 "time_elapsed": time_elapsed,
+                 "time_left": time_left }
 
     def _get_current_train_location(self, schedule):
         """Finds which station the train was last seen.
@@ -336,6 +483,39 @@ class Trip:
 
         return datetime.strptime("{0} {1}".format(date_str, time_str), "%Y-%m-%d %H:%M") 
 
+    def scheduled_stops(self):
+        """Lists the scheduled stops of this trip, independently of the trip date
+        Times are in minutes since midnight of the trip date. Times past midnight are
+        carried over instead of wrapping (ex: 00:15 the next day is 1455), which
+        works whether or not the schedule went through _adjust_day_difference.
+        Returns:
+            a list of (station_name, arrival_minutes, depart_minutes) tuples.
+            Missing times (first arrival, last departure) are None.
+        """
+        return self._scheduled_stops(self.schedule)
+
+    def _scheduled_stops(self, schedule):
+        """See scheduled_stops
+        Args:
+            schedule: a schedule struct
+        """
+        midnight = datetime.strptime(self.date, "%Y-%m-%d")
+        stops = []
+        last = 0
+        for s in schedule:
+            times = []
+            for key in ("arrival_time_scheduled", "depart_time_scheduled"):
+                if not s[key]:
+                    times.append(None)
+                    continue
+                minutes = int((s[key] - midnight).total_seconds()) // 60
+                # Same 10 minutes allowance as _adjust_day_difference
+                while minutes + 10 < last: minutes += 24 * 60
+                last = minutes
+                times.append(minutes)
+            stops.append((s["station_name"], times[0], times[1]))
+        return stops
+
     def pretty_print(self):
         """Pretty prints the trip schedule struct"""
         from pprint import pprint
@@ -343,36 +523,44 @@ class Trip:
 
     def table(self):
         """Returns a multiline string of a formatted trip timetable"""
+        return self._table(self.schedule)
+
+    def _table(self, schedule):
+        """See table
+        Args:
+            schedule: a schedule struct
+        """
         import prettytable
         table = prettytable.PrettyTable(["Station", "", "Scheduled", "Estimated", "Actual"])
         table.align = "l"
-        for s in self.schedule:
+        for s in schedule:
             table.add_row([s["station_name"], "Arr:", s["arrival_time_scheduled"], s["arrival_time_estimated"], s["arrival_time_actual"]])
             table.add_row(["",                "Dep:", s["depart_time_scheduled"],  s["depart_time_estimated"],  s["depart_time_actual"]])
         return str(table)
 
     def __repr__(self):
         """Recap. and current timetable of the trip"""
-        train_info = "Trip: Train #{0} ({1} to {2}) on {3}:".format(self.train, self.start_station_name, self.end_station_name, self.date)
+        snapshot = self.snapshot # Consistent view, even if another thread updates the trip
+        train_info = "Trip: Train #{0} ({1} to {2}) on {3}:".format(self.train, snapshot.start_station_name, snapshot.end_station_name, self.date)
         
-        if self.departed: departure_info = "The train has left {0} at {1}.".format(self.start_station_name, self.schedule[0]["depart_time_actual"])
-        else: departure_info = "The train has not left {0} yet. It is scheduled to leave on {1}".format(self.start_station_name, self.schedule[0]["depart_time_scheduled"])
+        if snapshot.departed: departure_info = "The train has left {0} at {1}.".format(snapshot.start_station_name, snapshot.schedule[0]["depart_time_actual"])
+        else: departure_info = "The train has not left {0} yet. It is scheduled to leave on {1}".format(snapshot.start_station_name, snapshot.schedule[0]["depart_time_scheduled"])
        
-        if self.arrived: arrival_info = "The train has arrived in {0} at {1}".format(self.end_station_name, self.schedule[-1]["arrival_time_actual"])
-        elif self.departed: arrival_info = "The train is estimated to arrive in {0} at {1}".format(self.end_station_name, self.schedule[-1]["arrival_time_estimated"])
-        else: arrival_info = "The train is scheduled to arrive in {0} at {1}".format(self.end_station_name, self.schedule[-1]["arrival_time_scheduled"])
+        if snapshot.arrived: arrival_info = "The train has arrived in {0} at {1}".format(snapshot.end_station_name, snapshot.schedule[-1]["arrival_time_actual"])
+        elif snapshot.departed: arrival_info = "The train is estimated to arrive in {0} at {1}".format(snapshot.end_station_name, snapshot.schedule[-1]["arrival_time_estimated"])
+        else: arrival_info = "The train is scheduled to arrive in {0} at {1}".format(snapshot.end_station_name, snapshot.schedule[-1]["arrival_time_scheduled"])
 
-        location_info = "The train was last seen in {0}.".format(self.current_station_name)
+        location_info = "The train was last seen in {0}.".format(snapshot.current_station_name)
 
-        if self.late: lateness_info = "late"
-        elif self.early: lateness_info = "early"
+        if snapshot.late: lateness_info = "late"
+        elif snapshot.early: lateness_info = "early"
         else: lateness_info = "on time"
 
-        print "Time difference with schedule: {0} ({1}).".format(self.schedule_timedelta, lateness_info)
-        print "Time Elapsed", self.time_elapsed
-        print "Time Left", self.time_left
+        print "Time difference with schedule: {0} ({1}).".format(snapshot.schedule_timedelta, lateness_info)
+        print "Time Elapsed", snapshot.time_elapsed
+        print "Time Left", snapshot.time_left
 
-        return train_info + "\n" + departure_info + "\n" + arrival_info + "\n" + location_info + "\n" + self.table()
+        return train_info + "\n" + departure_info + "\n" + arrival_info + "\n" + location_info + "\n" + self._table(snapshot.schedule)
 
 class TripNotFoundError(Exception):
     pass